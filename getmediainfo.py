@@ -1,14 +1,21 @@
 import os
-import hashlib
-import sqlite3
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import repeat
 from tqdm import tqdm
-from PIL import Image
-from PIL.ExifTags import TAGS
-from hachoir.parser import createParser
-from hachoir.metadata import extractMetadata
-from pathlib import Path
 import logging
+from media_core import (
+    MEDIA_TYPES,
+    SIZE_PLACEHOLDER_PREFIX,
+    create_connection,
+    create_table,
+    find_media_files,
+    get_file_info,
+    hash_file,
+    insert_file_infos,
+    rehash_stale_files,
+)
 
 
 # Set up logging to file
@@ -18,174 +25,120 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Define the file extensions for pictures and videos
-IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff'}
-VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv'}
+# Number of files inserted between commits
+COMMIT_INTERVAL = 1000
+# Number of rows sent to the database per executemany call
+BATCH_SIZE = 500
 
-# Create or connect to the SQLite database
-def create_connection(db_file):
-    conn = sqlite3.connect(db_file)
-    return conn
 
-# Create the table for storing file information
-def create_table(conn):
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS files (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            hash TEXT,
-            path TEXT,
-            size INTEGER,
-            date_taken TEXT,
-            date_saved TEXT,
-            duplicate INTEGER DEFAULT 0
-        )
-    ''')
-    conn.commit()
+def compute_record(media_file, full_hash, date_saved):
+    """Hash a (path, size, ctime) media file and read its info. Runs in a worker thread.
 
-def hash_file(filepath):
-    """Returns the SHA-1 hash of the file passed."""
-    hasher = hashlib.sha1()
-    with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hasher.update(chunk)
-    return hasher.hexdigest()
-
-def find_media_files(start_path):
-    media_files = {
-        'images': [],
-        'videos': []
-    }
-    
-    for dirpath, _, filenames in os.walk(start_path):
-        for filename in filenames:
-            _, ext = os.path.splitext(filename)
-            ext = ext.lower()
-            
-            if ext in IMAGE_EXTENSIONS:
-                media_files['images'].append(os.path.join(dirpath, filename))
-            elif ext in VIDEO_EXTENSIONS:
-                media_files['videos'].append(os.path.join(dirpath, filename))
-    
-    return media_files
-
-
-
-def get_file_info(filepath):
-    """Get file size and the actual date taken from metadata, if available."""
-    size = os.path.getsize(filepath)
-    date_taken = None
-
-    # Check if the file is an image and try to read the EXIF date taken
-    ext = Path(filepath).suffix.lower()
-    if ext in IMAGE_EXTENSIONS:
+    Returns None if the file can no longer be read, e.g. it was deleted or locked after the scan.
+    """
+    filepath, size, ctime = media_file
+    if full_hash:
         try:
-            with Image.open(filepath) as img:
-                exif_data = img._getexif()
-                if exif_data:
-                    for tag, value in exif_data.items():
-                        tag_name = TAGS.get(tag, tag)
-                        if tag_name == 'DateTimeOriginal':  # Common EXIF tag for date taken
-                            date_taken = value
-                            break
-        except Exception as e:
-            logging.info(f"Error reading EXIF data for {filepath}: {e}")
-
-    # If it's a video, try to read the metadata date
-    elif ext in VIDEO_EXTENSIONS:
-        try:
-            parser = createParser(filepath)
-            if parser:
-                metadata = extractMetadata(parser)
-                if metadata and metadata.has("creation_date"):
-                    date_taken = metadata.get("creation_date").strftime("%Y-%m-%d %H:%M:%S")
-        except Exception as e:
-            logging.error(f"Error reading video metadata for {filepath}: {e}")
-
-    # Fallback to creation date if no metadata date is found
-    if not date_taken:
-        date_taken = datetime.fromtimestamp(os.path.getctime(filepath)).isoformat()
+            file_hash = hash_file(filepath)
+        except OSError as e:
+            logging.warning(f"Cannot hash file {filepath}, skipping: {e}")
+            return None
+    else:
+        file_hash = f"{SIZE_PLACEHOLDER_PREFIX}{size}"
+    date_taken = get_file_info(filepath, ctime)
+    return file_hash, filepath, size, date_taken, date_saved
 
-    date_saved = datetime.now().isoformat()
-    return size, date_taken, date_saved
 
+def compute_records(executor, files, full_hashes, date_saved):
+    """Yield compute_record results in order, submitting COMMIT_INTERVAL files to the pool at a time.
 
-def insert_file_info(conn, file_info):
-    """Insert or update file information in the database."""
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO files (hash, path, size, date_taken, date_saved, duplicate)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', file_info)
-    conn.commit()
+    Bounds the number of pending futures instead of creating one per file up front.
+    """
+    for start in range(0, len(files), COMMIT_INTERVAL):
+        end = start + COMMIT_INTERVAL
+        yield from executor.map(compute_record, files[start:end], full_hashes[start:end], repeat(date_saved))
 
-def update_duplicate_count(conn, file_hash):
-    """Increment the duplicate count for a given hash."""
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE files
-        SET duplicate = duplicate + 1
-        WHERE hash = ?
-    ''', (file_hash,))
-    conn.commit()
 
-def find_duplicates_and_store(conn, files):
+def find_duplicates_and_store(conn, files, media_type):
     """Find duplicate files and store their information, comparing against the database."""
     cursor = conn.cursor()
-    hashes = {}
-
-    for file in tqdm(files, desc="Processing files"):
-        file_hash = hash_file(file)
-        size, date_taken, date_saved = get_file_info(file)
-
-        cursor.execute("SELECT COUNT(*) FROM files WHERE path = ?", (file,))
-        exists = cursor.fetchone()[0] > 0
-
-        if exists:
-            logging.info(f"Skipped duplicate file with the same path: {file} (Hash: {file_hash}) already exists in database.")
-            continue
-
-
-        # Check if the hash already exists in the database
-        cursor.execute('SELECT hash FROM files WHERE hash = ?', (file_hash,))
-        db_entry = cursor.fetchone()
-
-        if db_entry:
-            # File is a duplicate; insert it with duplicate marked as 1
-            file_info = (file_hash, file, size, date_taken, date_saved, 1)
-            insert_file_info(conn, file_info)
-        elif file_hash in hashes:
-            # File is a duplicate within the current set of files
-            file_info = (file_hash, file, size, date_taken, date_saved, 1)
-            insert_file_info(conn, file_info)
-        else:
-            # New file; insert its information with duplicate marked as 0
-            file_info = (file_hash, file, size, date_taken, date_saved, 0)
-            insert_file_info(conn, file_info)
-            hashes[file_hash] = file_hash  # Store the hash to track duplicates
+    file_type = MEDIA_TYPES[media_type]
+    batch = []
+
+    # Load the paths, hashes and sizes already stored so each file is checked in memory
+    known_paths = {row[0] for row in cursor.execute("SELECT path FROM files")}
+    known_hashes = {row[0] for row in cursor.execute("SELECT hash FROM files")}
+    known_sizes = {row[0] for row in cursor.execute("SELECT DISTINCT size FROM files")}
+
+    # Drop files stored by earlier runs before any hashing or metadata reads,
+    # so an incremental run only pays for new files
+    new_files = [media_file for media_file in files if media_file[0] not in known_paths]
+    if len(new_files) < len(files):
+        logging.info(f"Skipped {len(files) - len(new_files)} {media_type} whose path already exists in database.")
+
+    # Only files sharing their size with another file can be duplicates, so only those are hashed
+    size_counts = Counter(size for _, size, _ in new_files)
+    full_hashes = [size_counts[size] > 1 or size in known_sizes for _, size, _ in new_files]
+    date_saved = datetime.now().isoformat()
 
+    # Group inserts into transactions of COMMIT_INTERVAL files instead of committing per file;
+    # sqlite3 reopens a transaction implicitly on the first INSERT after each commit
+    cursor.execute("BEGIN")
+    # Stored files without a comparable hash need one now that a file of the same size showed up
+    rehash_stale_files(conn, known_sizes.intersection(size_counts), known_hashes)
+    # Hash files on all cores: blake3 releases the GIL while hashing the mapped file,
+    # so threads run in parallel without pickling results between processes.
+    # The database is only written from this thread.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        records = compute_records(executor, new_files, full_hashes, date_saved)
+        for count, record in enumerate(tqdm(records, total=len(new_files), desc="Processing files"), start=1):
+            if count % COMMIT_INTERVAL == 0:
+                conn.commit()
+
+            if record is None:
+                continue
+            file_hash, file, size, date_taken, date_saved = record
+
+            if file_hash in known_hashes:
+                # File is a duplicate of a stored file or of one seen earlier in this run
+                file_info = (file_hash, file, size, date_taken, date_saved, 1, file_type)
+            else:
+                # New file; insert its information with duplicate marked as 0
+                file_info = (file_hash, file, size, date_taken, date_saved, 0, file_type)
+                known_hashes.add(file_hash)
+
+            # A path found twice in this run, e.g. from overlapping search paths, is left to ON CONFLICT
+            batch.append(file_info)
+            if len(batch) >= BATCH_SIZE:
+                insert_file_infos(conn, batch)
+                batch.clear()
+
+    if batch:
+        insert_file_infos(conn, batch)
+    conn.commit()
 
 
-# Replace 'your_directory_path' with the actual path you want to search
-# path_to_search = r'H:\My Pictures'  # Use a raw string to avoid escape issues
+if __name__ == '__main__':
+    # Replace 'your_directory_path' with the actual path you want to search
+    # path_to_search = r'H:\My Pictures'  # Use a raw string to avoid escape issues
 
-paths_to_search = [r'H:\My Media']
-db_path = 'media_files_staging.db'  # Database file path
+    paths_to_search = [r'H:\My Media']
+    db_path = 'media_files_staging.db'  # Database file path
 
-# Connect to the database
-conn = create_connection(db_path)
-create_table(conn)
+    # Connect to the database
+    conn = create_connection(db_path)
+    create_table(conn)
 
-# Find media files from multiple paths
-all_media_files = {'images': [], 'videos': []}
-for path in paths_to_search:
-    found_media_files = find_media_files(path)
-    all_media_files['images'].extend(found_media_files['images'])
-    all_media_files['videos'].extend(found_media_files['videos'])
+    # Find media files from multiple paths
+    all_media_files = {'images': [], 'videos': []}
+    for path in paths_to_search:
+        found_media_files = find_media_files(path)
+        all_media_files['images'].extend(found_media_files['images'])
+        all_media_files['videos'].extend(found_media_files['videos'])
 
-# Process images and videos for duplicates and store them in the database
-for media_type in ['images', 'videos']:
-    find_duplicates_and_store(conn, all_media_files.get(media_type, []))
+    # Process images and videos for duplicates and store them in the database
+    for media_type in ['images', 'videos']:
+        find_duplicates_and_store(conn, all_media_files.get(media_type, []), media_type)
 
-# Close the database connection
-conn.close()
+    # Close the database connection
+    conn.close()
@@ -0,0 +1,339 @@
+import os
+import mmap
+import sqlite3
+import struct
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+from typing import BinaryIO, Optional
+from blake3 import blake3
+from PIL import Image
+from hachoir.parser import createParser  # type: ignore[import-untyped]
+from hachoir.metadata import extractMetadata  # type: ignore[import-untyped]
+from pathlib import Path
+import logging
+
+# A scanned media file: (path, size, ctime)
+MediaFile = tuple[str, int, float]
+
+# Define the file extensions for pictures and videos
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff'}
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv'}
+# The same extensions as tuples for str.endswith, which checks them all in one C call
+IMAGE_SUFFIXES = tuple(IMAGE_EXTENSIONS)
+VIDEO_SUFFIXES = tuple(VIDEO_EXTENSIONS)
+
+# Value stored in the type column for each media_files group
+MEDIA_TYPES = {'images': 'image', 'videos': 'video'}
+
+# Length of a hex BLAKE3 digest; stored hashes of any other length are SHA-1 hashes from
+# older runs or size placeholders and are re-hashed when a file of the same size is found
+HASH_HEX_LENGTH = 64
+
+# Files whose size matches no other file are stored with this prefix plus their size
+# instead of a content hash: they cannot have a duplicate, so hashing them is skipped
+SIZE_PLACEHOLDER_PREFIX = 'size:'
+
+# TIFF/EXIF constants used by the EXIF reader
+EXIF_IFD_POINTER = 0x8769
+DATE_TIME_ORIGINAL = 0x9003  # Common EXIF tag for date taken
+TIFF_ASCII = 2
+
+# Read size used when a file cannot be memory-mapped
+HASH_CHUNK_SIZE = 1 << 22  # 4 MiB
+# Number of sizes per stale-row query, keeping it under SQLite's default limit of 999 parameters
+SIZE_QUERY_CHUNK = 500
+
+# Create or connect to the SQLite database
+def create_connection(db_file: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_file)
+    # Bulk ingest tuning: WAL with synchronous=NORMAL needs one fsync per commit instead of two,
+    # and reads go through a 256 MB memory map and page cache
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-262144")
+    return conn
+
+# Create the table for storing file information
+def create_table(conn: sqlite3.Connection) -> None:
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            hash TEXT, -- BLAKE3 hex digest, or a size placeholder for files with a unique size
+            path TEXT,
+            size INTEGER,
+            date_taken TEXT,
+            date_saved TEXT,
+            duplicate INTEGER DEFAULT 0,
+            type TEXT, -- 'image' or 'video'
+            missing INTEGER DEFAULT 0 -- 1 once the stored path is gone, so it is no longer re-hashed
+        )
+    ''')
+    migrate_table(conn)
+    # Indexes for the per-file path and hash lookups
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_files_path ON files(path)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_hash ON files(hash)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_size ON files(size)')
+    conn.commit()
+
+def media_type_of(filepath: str) -> Optional[str]:
+    """Return the type column value for a path based on its extension, or None."""
+    ext = Path(filepath).suffix.lower()
+    if ext in IMAGE_EXTENSIONS:
+        return MEDIA_TYPES['images']
+    if ext in VIDEO_EXTENSIONS:
+        return MEDIA_TYPES['videos']
+    return None
+
+# Bring tables created by older versions up to the current schema
+def migrate_table(conn: sqlite3.Connection) -> None:
+    cursor = conn.cursor()
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(files)')}
+    if 'type' not in columns:
+        cursor.execute('ALTER TABLE files ADD COLUMN type TEXT')
+        rows = cursor.execute('SELECT id, path FROM files').fetchall()
+        cursor.executemany('UPDATE files SET type = ? WHERE id = ?',
+                           [(media_type_of(path), row_id) for row_id, path in rows])
+    if 'missing' not in columns:
+        cursor.execute('ALTER TABLE files ADD COLUMN missing INTEGER DEFAULT 0')
+
+def hash_file(filepath: str) -> str:
+    """Returns the BLAKE3 hash of the file passed."""
+    hasher = blake3(max_threads=blake3.AUTO)
+    with open(filepath, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            # Hint the kernel to read ahead aggressively; not available on Windows
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        try:
+            # Hash the whole file in one update straight from the page cache
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasher.update(mm)  # type: ignore[arg-type]  # blake3 accepts any buffer
+        except (ValueError, OSError):
+            # Empty files cannot be mapped (ValueError), nor can files on filesystems
+            # without mmap support such as some FUSE or network mounts (OSError)
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _scan_tree(path: str) -> Iterator[os.DirEntry[str]]:
+    """Recursively yield a DirEntry for every file under path, skipping hidden directories."""
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith('.'):
+                        yield from _scan_tree(entry.path)
+                elif entry.is_file():
+                    yield entry
+    except OSError as e:
+        logging.error(f"Error scanning directory {path}: {e}")
+
+def find_media_files(start_path: str) -> dict[str, list[MediaFile]]:
+    """Find media files under start_path as (path, size, ctime) tuples."""
+    scanned: dict[str, list[tuple[int, str, int, float]]] = {
+        'images': [],
+        'videos': []
+    }
+
+    # scandir returns the stat data with the directory listing on Windows,
+    # so each file is stat-ed at most once here and never again later
+    for entry in _scan_tree(start_path):
+        # Lowercase first so mixed-case names like IMG_0001.Jpg still match
+        name = entry.name.lower()
+
+        if name.endswith(IMAGE_SUFFIXES):
+            media_type = 'images'
+        elif name.endswith(VIDEO_SUFFIXES):
+            media_type = 'videos'
+        else:
+            continue
+
+        try:
+            stat = entry.stat()
+            inode = entry.inode()
+        except OSError as e:
+            logging.error(f"Error reading file attributes for {entry.path}: {e}")
+            continue
+        scanned[media_type].append((inode, entry.path, stat.st_size, stat.st_ctime))
+
+    # Process files in inode order, which roughly follows their layout on disk,
+    # so hashing reads sequentially instead of seeking back and forth.
+    # DirEntry.inode() returns the NTFS file index on Windows.
+    media_files: dict[str, list[MediaFile]] = {}
+    for media_type, files in scanned.items():
+        files.sort()
+        media_files[media_type] = [(path, size, ctime) for _, path, size, ctime in files]
+
+    return media_files
+
+
+
+def _read_ifd(f: BinaryIO, base: int, offset: int, endian: str) -> dict[int, object]:
+    """Read the ASCII tags and the EXIF sub-IFD pointer of one TIFF image file directory."""
+    f.seek(base + offset)
+    (count,) = struct.unpack(endian + 'H', f.read(2))
+    entries = f.read(12 * count)
+
+    tags: dict[int, object] = {}
+    for index in range(len(entries) // 12):
+        tag, tag_type, length, value = struct.unpack_from(endian + 'HHI4s', entries, index * 12)
+        if tag == EXIF_IFD_POINTER:
+            tags[tag] = struct.unpack(endian + 'I', value)[0]
+        elif tag_type == TIFF_ASCII:
+            if length > 4:
+                # Values that don't fit in the entry are stored at an offset from the TIFF header
+                f.seek(base + struct.unpack(endian + 'I', value)[0])
+                value = f.read(length)
+            tags[tag] = value[:length].split(b'\0', 1)[0].decode('ascii', errors='replace')
+    return tags
+
+def _read_tiff_tags(f: BinaryIO, base: int) -> dict[int, object]:
+    """Read the ASCII tags of IFD0 and the EXIF sub-IFD from a TIFF header at base."""
+    f.seek(base)
+    header = f.read(8)
+    if header[:2] == b'II':
+        endian = '<'
+    elif header[:2] == b'MM':
+        endian = '>'
+    else:
+        return {}
+    magic, ifd0_offset = struct.unpack(endian + 'HI', header[2:8])
+    if magic != 42:
+        return {}
+
+    tags = _read_ifd(f, base, ifd0_offset, endian)
+    exif_offset = tags.pop(EXIF_IFD_POINTER, None)
+    if isinstance(exif_offset, int) and exif_offset:
+        tags.update(_read_ifd(f, base, exif_offset, endian))
+    return tags
+
+def _find_jpeg_exif(f: BinaryIO) -> Optional[int]:
+    """Return the offset of the TIFF header inside a JPEG APP1 Exif segment, or None."""
+    f.seek(2)
+    while True:
+        if f.read(1) != b'\xff':
+            return None
+        marker = f.read(1)
+        # Any number of 0xFF fill bytes may precede a marker
+        while marker == b'\xff':
+            marker = f.read(1)
+        # Metadata segments all come before the start of scan
+        if not marker or marker[0] in (0xDA, 0xD9):
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        (length,) = struct.unpack('>H', length_bytes)
+        if length < 2:
+            # The length includes its own two bytes, so the segment is corrupt
+            return None
+        if marker[0] == 0xE1 and length >= 8:
+            if f.read(6) == b'Exif\0\0':
+                return f.tell()
+            f.seek(length - 8, 1)
+        else:
+            f.seek(length - 2, 1)
+
+def read_exif_tags(filepath: str) -> Optional[dict[int, object]]:
+    """Read the ASCII EXIF tags of a JPEG or TIFF file by tag id, without decoding the image.
+
+    Returns None for other formats.
+    """
+    with open(filepath, 'rb') as f:
+        signature = f.read(4)
+        if signature[:2] == b'\xff\xd8':
+            base = _find_jpeg_exif(f)
+            return _read_tiff_tags(f, base) if base is not None else {}
+        if signature in (b'II*\0', b'MM\0*'):
+            return _read_tiff_tags(f, 0)
+    return None
+
+def _read_date_taken_image(filepath: str) -> Optional[str]:
+    """Return the EXIF DateTimeOriginal of an image, or None if it has none."""
+    try:
+        exif_data = read_exif_tags(filepath)
+    except (struct.error, OSError):
+        # Truncated or corrupt EXIF data; Pillow's parser copes with more broken files
+        exif_data = None
+    if not exif_data:
+        # Other formats, and JPEG/TIFF files the fast reader found no tags in, are left to Pillow
+        with Image.open(filepath) as img:
+            exif_data = img._getexif()  # type: ignore[attr-defined]
+    if exif_data:
+        value = exif_data.get(DATE_TIME_ORIGINAL)
+        if isinstance(value, str):
+            return value
+    return None
+
+def get_file_info(filepath: str, ctime: float) -> str:
+    """Get the actual date taken from metadata, falling back to the file's creation time."""
+    date_taken: Optional[str] = None
+
+    # Check if the file is an image and try to read the EXIF date taken
+    ext = Path(filepath).suffix.lower()
+    if ext in IMAGE_EXTENSIONS:
+        try:
+            date_taken = _read_date_taken_image(filepath)
+        except Exception as e:
+            logging.info(f"Error reading EXIF data for {filepath}: {e}")
+
+    # If it's a video, try to read the metadata date
+    elif ext in VIDEO_EXTENSIONS:
+        try:
+            parser = createParser(filepath)
+            if parser:
+                metadata = extractMetadata(parser)
+                if metadata and metadata.has("creation_date"):
+                    date_taken = metadata.get("creation_date").strftime("%Y-%m-%d %H:%M:%S")
+        except Exception as e:
+            logging.error(f"Error reading video metadata for {filepath}: {e}")
+
+    # Fallback to creation date if no metadata date is found
+    if not date_taken:
+        date_taken = datetime.fromtimestamp(ctime).isoformat()
+
+    return date_taken
+
+
+def insert_file_infos(conn: sqlite3.Connection, file_infos: Iterable[tuple[object, ...]]) -> None:
+    """Insert a batch of file information rows in the database, skipping paths already stored.
+
+    The caller is responsible for committing.
+    """
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO files (hash, path, size, date_taken, date_saved, duplicate, type)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(path) DO NOTHING
+    ''', file_infos)
+
+def rehash_stale_files(conn: sqlite3.Connection, sizes: set[int], known_hashes: set[str]) -> None:
+    """Give stored files with these sizes a BLAKE3 hash if they only have a placeholder or an old SHA-1 hash."""
+    cursor = conn.cursor()
+    size_list = sorted(sizes)
+    stale_files: list[tuple[str, int]] = []
+    for start in range(0, len(size_list), SIZE_QUERY_CHUNK):
+        chunk = size_list[start:start + SIZE_QUERY_CHUNK]
+        placeholders = ', '.join('?' for _ in chunk)
+        cursor.execute(f'''
+            SELECT path, size FROM files
+            WHERE size IN ({placeholders}) AND length(hash) != ? AND missing = 0
+        ''', [*chunk, HASH_HEX_LENGTH])
+        stale_files.extend(cursor.fetchall())
+
+    for path, size in stale_files:
+        try:
+            file_hash = hash_file(path)
+        except FileNotFoundError:
+            # Moved or deleted, e.g. by reorder.py; don't retry it on every later run
+            logging.warning(f"Stored file {path} no longer exists; it will not be compared with new files of size {size}.")
+            cursor.execute('UPDATE files SET missing = 1 WHERE path = ?', (path,))
+            continue
+        except OSError as e:
+            logging.warning(f"Cannot hash stored file {path} to compare with new files of size {size}: {e}")
+            continue
+        cursor.execute('UPDATE files SET hash = ? WHERE path = ?', (file_hash, path))
+        known_hashes.add(file_hash)
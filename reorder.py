@@ -1,8 +1,9 @@
 import os
-import sqlite3
 import shutil
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from media_core import create_connection, create_table
 
 # Set up logging to file
 logging.basicConfig(
@@ -11,40 +12,47 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# File extensions for identifying photos and videos
-IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff'}
-VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv'}
-
 # Define base directories for organizing photos and videos
 BASE_LOCATION = r'H:\My Media'
 BASE_PHOTO_DIR = os.path.join(BASE_LOCATION, 'photos')
 BASE_VIDEO_DIR = os.path.join(BASE_LOCATION, 'videos')
+# Base directory for each value of the files.type column
+BASE_DIRS = {'image': BASE_PHOTO_DIR, 'video': BASE_VIDEO_DIR}
+
+# Number of files moved concurrently
+MOVE_WORKERS = 8
+
+
+def move_file(move):
+    """Move a (source, destination) pair, logging the outcome."""
+    file_path, destination_path = move
+    try:
+        shutil.move(file_path, destination_path)
+        logging.info(f"Moved {file_path} to {destination_path}")
+    except Exception as e:
+        logging.error(f"Error moving file {file_path}: {e}")
+
 
 # Connect to the media_files.db database
 db_path = 'media_files_staging.db'
-conn = sqlite3.connect(db_path)
+conn = create_connection(db_path)
+# Brings databases written by older versions up to the current schema
+create_table(conn)
 cursor = conn.cursor()
 
-# Dictionary to track moved files by hash to avoid moving duplicates
-moved_files = {}
-
-# Fetch all records from the files database
-cursor.execute("SELECT path, hash, date_taken FROM files")
-file_records = cursor.fetchall()
+# Pending (source, destination) moves and the directories they need
+moves = []
+destination_dirs = set()
+# Source claiming each destination; normcase so names differing only in case collide on Windows
+destination_sources = {}
 
-for file_path, file_hash, date_taken in file_records:
-     # Skip if this file hash has already been moved
-    if file_hash in moved_files:
-        logging.info(f"Skipped duplicate: {file_path} (Hash: {file_hash}) already exists in database.")
-        continue
-    
-    # Determine if the file is a photo or video based on its extension
-    ext = Path(file_path).suffix.lower()
-    if ext in IMAGE_EXTENSIONS:
-        base_dir = BASE_PHOTO_DIR
-    elif ext in VIDEO_EXTENSIONS:
-        base_dir = BASE_VIDEO_DIR
-    else:
+# Fetch one row per hash so duplicates are never moved; SQLite takes the bare
+# columns from the row with MIN(id), i.e. the first copy that was stored
+for _, file_path, date_taken, file_type in cursor.execute(
+        "SELECT MIN(id), path, date_taken, type FROM files GROUP BY hash"):
+    # Pick the photo or video directory from the type stored at ingest
+    base_dir = BASE_DIRS.get(file_type)
+    if base_dir is None:
         logging.warning(f"Unknown file type for {file_path}, skipping.")
         continue
 
@@ -53,21 +61,29 @@ for file_path, file_hash, date_taken in file_records:
 
     # Define the destination directory based on type and year
     destination_dir = os.path.join(base_dir, year)
-    os.makedirs(destination_dir, exist_ok=True)
 
     # Define the destination path
     destination_path = os.path.join(destination_dir, Path(file_path).name)
-    
-    # Move the file
-    try:
-        shutil.move(file_path, destination_path)
-        logging.info(f"Moved {file_path} to {destination_path}")
-    except Exception as e:
-        logging.error(f"Error moving file {file_path}: {e}")
+
+    # Different files with the same name, type and year would overwrite each other
+    # when moved concurrently, so only the first one is moved
+    destination_key = os.path.normcase(destination_path)
+    if destination_key in destination_sources:
+        logging.warning(f"Destination {destination_path} of {file_path} is already taken by "
+                        f"{destination_sources[destination_key]}, skipping.")
         continue
+    destination_sources[destination_key] = file_path
+
+    destination_dirs.add(destination_dir)
+    moves.append((file_path, destination_path))
+
+# Create every destination directory up front so the movers don't race on makedirs
+for destination_dir in destination_dirs:
+    os.makedirs(destination_dir, exist_ok=True)
 
-    # Mark this hash as moved
-    moved_files[file_hash] = destination_path
+# Move the files; moves are pure I/O, so threads overlap the filesystem latency
+with ThreadPoolExecutor(max_workers=MOVE_WORKERS) as executor:
+    list(executor.map(move_file, moves))
 
 # Close the database connection
 conn.close()
@@ -0,0 +1,105 @@
+import struct
+
+import pytest
+
+import media_core
+
+DATE = '2019:01:02 10:11:12'
+
+
+def tiff(endian, date=DATE):
+    """Build a TIFF header with IFD0 pointing to an EXIF sub-IFD holding DateTimeOriginal."""
+    order = b'II' if endian == '<' else b'MM'
+    value = date.encode('ascii') + b'\0'
+    # Header (8 bytes), IFD0 at 8 (18 bytes), EXIF IFD at 26 (18 bytes), string at 44
+    data = order + struct.pack(endian + 'HI', 42, 8)
+    data += struct.pack(endian + 'H', 1)
+    data += struct.pack(endian + 'HHII', media_core.EXIF_IFD_POINTER, 4, 1, 26)
+    data += struct.pack(endian + 'I', 0)
+    data += struct.pack(endian + 'H', 1)
+    data += struct.pack(endian + 'HHII', media_core.DATE_TIME_ORIGINAL, media_core.TIFF_ASCII, len(value), 44)
+    data += struct.pack(endian + 'I', 0)
+    return data + value
+
+
+def segment(marker, payload):
+    return b'\xff' + bytes([marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+
+def jpeg(*segments):
+    return b'\xff\xd8' + b''.join(segments) + b'\xff\xda\x00\x02' + b'\x00' * 16 + b'\xff\xd9'
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.fixture
+def pillow_fallback(monkeypatch):
+    """Replace Pillow with a fake that records which files it was asked to open."""
+    opened = []
+
+    class FakeImage:
+        def __init__(self, filepath):
+            opened.append(filepath)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def _getexif(self):
+            return {media_core.DATE_TIME_ORIGINAL: 'from pillow'}
+
+    monkeypatch.setattr(media_core.Image, 'open', FakeImage)
+    return opened
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_read_exif_tags_tiff(tmp_path, endian):
+    path = write(tmp_path, 'a.tiff', tiff(endian))
+    assert media_core.read_exif_tags(path) == {media_core.DATE_TIME_ORIGINAL: DATE}
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_read_exif_tags_jpeg(tmp_path, endian):
+    path = write(tmp_path, 'a.jpg', jpeg(segment(0xE0, b'JFIF\0' + b'\0' * 9), segment(0xE1, b'Exif\0\0' + tiff(endian))))
+    assert media_core.read_exif_tags(path) == {media_core.DATE_TIME_ORIGINAL: DATE}
+
+
+def test_read_exif_tags_skips_xmp_before_exif(tmp_path):
+    xmp = segment(0xE1, b'http://ns.adobe.com/xap/1.0/\0<x:xmpmeta/>')
+    path = write(tmp_path, 'a.jpg', jpeg(xmp, segment(0xE1, b'Exif\0\0' + tiff('<'))))
+    assert media_core.read_exif_tags(path) == {media_core.DATE_TIME_ORIGINAL: DATE}
+
+
+def test_read_exif_tags_skips_fill_bytes(tmp_path):
+    path = write(tmp_path, 'a.jpg', b'\xff\xd8\xff\xff' + segment(0xE1, b'Exif\0\0' + tiff('<'))[1:] + b'\xff\xd9')
+    assert media_core.read_exif_tags(path) == {media_core.DATE_TIME_ORIGINAL: DATE}
+
+
+def test_read_exif_tags_other_formats(tmp_path):
+    path = write(tmp_path, 'a.png', b'\x89PNG\r\n\x1a\n')
+    assert media_core.read_exif_tags(path) is None
+
+
+def test_date_taken_from_fast_reader(tmp_path, pillow_fallback):
+    path = write(tmp_path, 'a.jpg', jpeg(segment(0xE1, b'Exif\0\0' + tiff('>'))))
+    assert media_core._read_date_taken_image(path) == DATE
+    assert pillow_fallback == []
+
+
+@pytest.mark.parametrize('data', [
+    jpeg(),  # no Exif segment at all
+    b'\xff\xd8\xff\xe1\x00\x00' + b'\0' * 16,  # zero-length segment
+    jpeg(segment(0xE1, b'Exif\0\0' + tiff('<')))[:30],  # Exif segment cut off mid-IFD
+    jpeg(segment(0xE1, b'Exif\0\0' + tiff('<')[:8])),  # IFD0 offset points past the end
+    jpeg(segment(0xE1, b'Exif\0\0' + b'XX' + tiff('<')[2:])),  # unknown byte order
+], ids=['no-exif', 'zero-length', 'truncated', 'missing-ifd', 'bad-byte-order'])
+def test_date_taken_falls_back_to_pillow(tmp_path, pillow_fallback, data):
+    path = write(tmp_path, 'a.jpg', data)
+    assert media_core._read_date_taken_image(path) == 'from pillow'
+    assert pillow_fallback == [path]